@@ -1,10 +1,13 @@
 # SPDX-License-Identifier: Apache-2.0
 
+import copy
 import json
 import pickle
+import re
 
 import pytest
 import torch
+from outlines_core.fsm.regex import byte_symbol, reduced_vocabulary
 from transformers import AutoTokenizer
 
 from vllm.config import ModelConfig
@@ -12,7 +15,9 @@ from vllm.model_executor.guided_decoding import (
     get_guided_decoding_logits_processor,
     get_local_guided_decoding_logits_processor)
 from vllm.model_executor.guided_decoding.outlines_logits_processors import (
-    JSONLogitsProcessor, RegexLogitsProcessor)
+    JSONLogitsProcessor, RegexLogitsProcessor, _adapt_tokenizer,
+    _has_byte_level_decoder, _reduced_vocabulary)
+from vllm.model_executor.guided_decoding.utils import choice_as_regex
 from vllm.sampling_params import GuidedDecodingParams
 
 MODEL_NAME = 'HuggingFaceH4/zephyr-7b-beta'
@@ -63,6 +68,80 @@ def test_guided_logits_processors(zephyr_7B_tokenzer, sample_regex,
     assert not torch.allclose(tensor, original_tensor)
 
 
+def test_guided_logits_processors_apply_batch(zephyr_7B_tokenzer, sample_regex,
+                                              sample_json_schema):
+    """Batched application must match applying each processor per row."""
+    processors = [
+        RegexLogitsProcessor(sample_regex, zephyr_7B_tokenzer, reasoner=None),
+        JSONLogitsProcessor(sample_json_schema,
+                            zephyr_7B_tokenzer,
+                            whitespace_pattern=None,
+                            reasoner=None),
+    ]
+    input_ids: list[list[int]] = [[], []]
+    logits = torch.rand(3, 32000)
+    expected = torch.clone(logits)
+    for row_idx, (processor, ids) in enumerate(zip(processors, input_ids)):
+        expected[row_idx] = processor(ids, expected[row_idx])
+
+    logits = RegexLogitsProcessor.apply_batch(logits, [0, 1], processors,
+                                              input_ids)
+    assert torch.equal(logits, expected)
+
+
+def test_guided_logits_processors_share_guide(zephyr_7B_tokenzer,
+                                              sample_regex):
+    """Processors for the same regex and tokenizer reuse one guide."""
+    first_LP = RegexLogitsProcessor(sample_regex,
+                                    zephyr_7B_tokenzer,
+                                    reasoner=None)
+    second_LP = RegexLogitsProcessor(sample_regex,
+                                     zephyr_7B_tokenzer,
+                                     reasoner=None)
+    assert first_LP._guide is second_LP._guide
+
+
+def _sorted_vocabulary(vocabulary):
+    return {token: sorted(ids) for token, ids in vocabulary.items()}
+
+
+@pytest.mark.parametrize("tokenizer_fixture",
+                         ["zephyr_7B_tokenzer", "deepseek_r1_qwen_tokenizer"])
+def test_reduced_vocabulary_matches_outlines(request, tokenizer_fixture):
+    """The reduced vocabulary matches the one built by outlines_core."""
+    tokenizer = _adapt_tokenizer(request.getfixturevalue(tokenizer_fixture))
+    vocabulary, empty_token_ids = _reduced_vocabulary(tokenizer)
+    expected_vocabulary, expected_empty_token_ids = (
+        reduced_vocabulary.__wrapped__(tokenizer))
+
+    assert _sorted_vocabulary(vocabulary) == _sorted_vocabulary(
+        expected_vocabulary)
+    assert empty_token_ids == expected_empty_token_ids
+
+
+def test_reduced_vocabulary_byte_level(deepseek_r1_qwen_tokenizer):
+    """Byte-level tokens reduce like outlines_core, added tokens included."""
+    tokenizer = copy.deepcopy(deepseek_r1_qwen_tokenizer)
+    tokenizer.add_tokens(["<vllm_added>", "vllm added token"])
+    tokenizer = _adapt_tokenizer(tokenizer)
+    assert _has_byte_level_decoder(tokenizer)
+
+    vocabulary, empty_token_ids = _reduced_vocabulary(tokenizer)
+    expected_vocabulary, expected_empty_token_ids = (
+        reduced_vocabulary.__wrapped__(tokenizer))
+    assert _sorted_vocabulary(vocabulary) == _sorted_vocabulary(
+        expected_vocabulary)
+    assert empty_token_ids == expected_empty_token_ids
+
+    for token in ("<vllm_added>", "vllm added token"):
+        assert tokenizer.vocabulary[token] in vocabulary[token]
+    # "âĢ" is the bytes E2 80, the start of a UTF-8 sequence such as "‘";
+    # on its own it is not valid UTF-8 and is kept as byte symbols.
+    partial_token_id = tokenizer.vocabulary["âĢ"]
+    assert partial_token_id in vocabulary[byte_symbol(0xE2) +
+                                          byte_symbol(0x80)]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("backend", GUIDED_DECODING_BACKENDS)
 @pytest.mark.parametrize("is_local", [True, False])
@@ -200,6 +279,16 @@ def test_multiple_guided_options_not_allowed(sample_json_schema, sample_regex):
         GuidedDecodingParams(json=sample_json_schema, grammar="test grammar")
 
 
+@pytest.mark.parametrize("choices", [
+    ["a|b", "(x)*", "1.5", "[y]?", "plain"],
+    ["sep\x1farated", "a|b", "(x)*", "\x1f"],
+])
+def test_choice_as_regex(choices):
+    expected = "(" + "|".join(re.escape(choice) for choice in choices) + ")"
+    assert choice_as_regex(choices) == expected
+    assert re.fullmatch(choice_as_regex(choices), choices[1])
+
+
 def test_guided_decoding_backend_options():
     """Test backend-specific options"""
     params = GuidedDecodingParams(
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import torch
+
+from vllm.v1.structured_output import StructuredOutputManager
+
+
+class _FakeGrammar:
+
+    def __init__(self, terminated: bool):
+        self.terminated = terminated
+
+    def fill_bitmask(self, bitmask: torch.Tensor, idx: int) -> None:
+        bitmask[idx] = torch.arange(bitmask.shape[1], dtype=torch.int32) + idx
+
+    def is_terminated(self) -> bool:
+        return self.terminated
+
+
+def _grammar_bitmask(fill_in_parallel: bool, batch_len: int) -> np.ndarray:
+    vllm_config = MagicMock()
+    vllm_config.scheduler_config.max_num_seqs = batch_len + 8
+    manager = StructuredOutputManager(vllm_config)
+    manager.backend = MagicMock()
+    manager.backend.allocate_token_bitmask.side_effect = (
+        lambda max_num_seqs: torch.full(
+            (max_num_seqs, 4), -1, dtype=torch.int32))
+    manager._fill_bitmask_in_parallel = fill_in_parallel
+
+    requests = {}
+    structured_output_request_ids = {}
+    for i in range(batch_len):
+        grammar = _FakeGrammar(terminated=i % 7 == 0)
+        requests[f"req-{i}"] = SimpleNamespace(
+            structured_output_request=SimpleNamespace(grammar=grammar))
+        # Map requests to batch rows out of order.
+        structured_output_request_ids[f"req-{i}"] = batch_len - 1 - i
+
+    return manager.grammar_bitmask(requests, structured_output_request_ids,
+                                   batch_len)
+
+
+def test_grammar_bitmask_parallel_fill_matches_sequential():
+    batch_len = 2 * StructuredOutputManager._FILL_BITMASK_PARALLEL_THRESHOLD + 5
+    sequential = _grammar_bitmask(fill_in_parallel=False, batch_len=batch_len)
+    parallel = _grammar_bitmask(fill_in_parallel=True, batch_len=batch_len)
+    assert sequential.shape == (batch_len, 4)
+    assert np.array_equal(parallel, sequential)
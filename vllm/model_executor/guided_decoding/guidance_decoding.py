@@ -1,11 +1,10 @@
 # SPDX-License-Identifier: Apache-2.0
-from re import escape as regex_escape
-
 import llguidance
 from transformers import PreTrainedTokenizerBase
 
 from vllm.model_executor.guided_decoding.guidance_logits_processors import (
     GuidanceLogitsProcessor)
+from vllm.model_executor.guided_decoding.utils import choice_as_regex
 from vllm.sampling_params import GuidedDecodingParams
 
 
@@ -38,10 +37,8 @@ def get_local_guidance_guided_decoding_logits_processor(
         grm = llguidance.grammar_from("regex", guided_params.regex)
     elif guided_params.choice:
         # choice just uses regex
-        choices = (regex_escape(str(choice))
-                   for choice in guided_params.choice)
-        choices_regex = "(" + "|".join(choices) + ")"
-        grm = llguidance.grammar_from("regex", choices_regex)
+        grm = llguidance.grammar_from("regex",
+                                      choice_as_regex(guided_params.choice))
     elif guided_params.grammar:
         # this supports Lark and GBNF
         grm = llguidance.grammar_from("grammar", guided_params.grammar)
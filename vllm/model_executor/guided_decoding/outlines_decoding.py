@@ -5,13 +5,13 @@ import concurrent.futures
 import os
 from enum import Enum
 from json import dumps as json_dumps
-from re import escape as regex_escape
 from typing import Optional, Tuple, Union
 
 from transformers import PreTrainedTokenizerBase
 
 from vllm.model_executor.guided_decoding.outlines_logits_processors import (
     CFGLogitsProcessor, JSONLogitsProcessor, RegexLogitsProcessor)
+from vllm.model_executor.guided_decoding.utils import choice_as_regex
 from vllm.reasoning import ReasoningParser
 from vllm.sampling_params import GuidedDecodingParams
 
@@ -123,11 +123,8 @@ def _get_guide_and_mode(
         return guided_params.regex, GuidedDecodingMode.REGEX
     elif guided_params.choice:
         # choice just uses regex
-        choices = [
-            regex_escape(str(choice)) for choice in guided_params.choice
-        ]
-        choices_regex = "(" + "|".join(choices) + ")"
-        return choices_regex, GuidedDecodingMode.CHOICE
+        return (choice_as_regex(guided_params.choice),
+                GuidedDecodingMode.CHOICE)
     elif guided_params.grammar:
         return guided_params.grammar, GuidedDecodingMode.GRAMMAR
     elif guided_params.json_object:
@@ -17,38 +17,90 @@
 # limitations under the License.
 import copy
 import json
+import threading
+import weakref
 from collections import defaultdict
 from functools import lru_cache
-from typing import Callable, DefaultDict, Dict, List, Optional, Union
+from typing import (Any, Callable, DefaultDict, Dict, List, Optional, Set,
+                    Tuple, Union)
 
-import numpy as np
 import torch
 from outlines import grammars
-from outlines.caching import cache, disable_cache
-from outlines.fsm.guide import (CFGGuide, CFGState, Generate, Guide,
-                                RegexGuide, Write)
+from outlines.caching import cache, disable_cache, get_cache
+from outlines.fsm.guide import (CFGGuide, CFGState, Generate, Guide, Write)
 from outlines.fsm.parsing import PartialLark
+from outlines_core.fsm.guide import RegexGuide
 from outlines_core.fsm.json_schema import build_regex_from_schema
+from outlines_core.fsm.regex import (Index, Vocabulary, byte_symbol,
+                                     gpt2_unicode_to_bytes,
+                                     make_byte_level_fsm,
+                                     make_deterministic_fsm,
+                                     re_replacement_seq)
 from pydantic import BaseModel
-from transformers import PreTrainedTokenizerBase
+from tokenizers import decoders
+from transformers import PreTrainedTokenizerBase, PreTrainedTokenizerFast
+from transformers.file_utils import SPIECE_UNDERLINE
 
 import vllm.envs as envs
 from vllm.logger import init_logger
 from vllm.platforms import current_platform
 from vllm.reasoning import ReasoningParser
+from vllm.utils import LRUCache, async_tensor_h2d, is_pin_memory_available
 
 logger = init_logger(__name__)
 
+# Symbols used by the byte-level FSM for every byte value, see
+# `outlines_core.fsm.regex.byte_symbol`.
+_BYTE_SYMBOLS = [byte_symbol(b) for b in range(256)]
+_GPT2_UNICODE_TO_BYTES = gpt2_unicode_to_bytes()
+# Translation table from the characters of byte-level BPE tokens to the
+# latin-1 characters of the bytes they stand for.
+_GPT2_UNICODE_TO_LATIN1 = str.maketrans({
+    c: chr(b)
+    for c, b in _GPT2_UNICODE_TO_BYTES.items()
+})
+_GPT2_UNICODE_CHARS = frozenset(_GPT2_UNICODE_TO_BYTES)
+# Byte symbols of the `<0xXX>` byte tokens of llama-like tokenizers, i.e. the
+# tokens matched by `outlines_core.fsm.regex.re_llama_byte_token`.
+_LLAMA_BYTE_TOKEN_SYMBOLS = {
+    f"<0x{b:02X}>": symbol
+    for b, symbol in enumerate(_BYTE_SYMBOLS)
+}
+
 if envs.VLLM_V0_USE_OUTLINES_CACHE:
-    logger.warning("Enabling outlines cache. This is an unbounded on-disk "
-                   "cache. It may consume a lot of disk space and should "
-                   "not be used with untrusted clients.")
+    logger.warning(
+        "Enabling outlines cache. This is an on-disk cache of up to %d MB. "
+        "It should not be used with untrusted clients.",
+        envs.VLLM_V0_OUTLINES_CACHE_MB)
+    # outlines creates its cache without any eviction, so bound it and
+    # evict the least recently used guides instead. Each reset is a write
+    # to the cache database, so skip the settings that already have the
+    # wanted value, e.g. the size limit set by an earlier process.
+    _outlines_cache = get_cache()
+    for _key, _value in (
+        ("eviction_policy", "least-recently-used"),
+        ("size_limit", envs.VLLM_V0_OUTLINES_CACHE_MB * 1024 * 1024),
+        ("cull_limit", 10),
+    ):
+        if getattr(_outlines_cache, _key) != _value:
+            _outlines_cache.reset(_key, _value)
 else:
     disable_cache()
 
 
 class BaseLogitsProcessor:
 
+    # Allowed token ids of the FSM states visited so far, already on the
+    # device of the logits, keyed by state and device. They are kept per
+    # guide so that they are freed along with it, and bounded both in states
+    # and in ids (1 MiB of int64s per guide), since this memory is not
+    # accounted for by the memory profiling of the model runner.
+    _DEVICE_CACHE_MAX_STATES = 64
+    _DEVICE_CACHE_MAX_TOKENS = 1 << 17
+    _allowed_tokens_caches: weakref.WeakKeyDictionary[Guide, LRUCache[Tuple[
+        int, torch.device], torch.Tensor]] = weakref.WeakKeyDictionary()
+    _allowed_tokens_cache_lock = threading.Lock()
+
     def __init__(self, guide: Guide, reasoner: Optional[ReasoningParser]):
         self._guide: Guide = guide
         self._reasoner: Optional[ReasoningParser] = reasoner
@@ -59,12 +111,93 @@ class BaseLogitsProcessor:
     def __call__(self, input_ids: List[int],
                  scores: torch.Tensor) -> torch.Tensor:
         """Use the FSM to bias the logits before sampling the next token."""
+        allowed_tokens = self._get_allowed_tokens(input_ids, scores.shape[-1],
+                                                  scores.device)
+        if allowed_tokens is None:
+            return scores
+
+        # The mask marks the disallowed tokens. A boolean mask is a quarter
+        # of the size of a float one and `masked_fill_` writes `-inf` without
+        # having to read a bias back.
+        mask = torch.ones(scores.shape[-1],
+                          dtype=torch.bool,
+                          device=scores.device)
+        mask.index_fill_(0, allowed_tokens, False)
+        if current_platform.is_hpu():
+            # Workaround for HPU bug where in-place ops like add_() raise
+            # RuntimeError: synNodeCreateWithId failed for node:
+            # strided_insert with synStatus 1 [Invalid argument], hopefully
+            # it will be fixed in the future releases of the HPU runtime.
+            scores = scores.masked_fill(mask, -torch.inf)
+        else:
+            scores.masked_fill_(mask, -torch.inf)
+        return scores
+
+    @classmethod
+    def apply_batch(cls, logits: torch.Tensor, row_indices: List[int],
+                    processors: List["BaseLogitsProcessor"],
+                    input_ids: List[List[int]]) -> torch.Tensor:
+        """Apply the FSM of several sequences to their rows of `logits`.
+
+        This is equivalent to calling each processor on its own row, but
+        issues a single masking update for the whole batch instead of one
+        per sequence.
+        """
+        vocab_size = logits.shape[-1]
+        masked_rows: List[int] = []
+        num_allowed_tokens: List[int] = []
+        allowed_tokens_list: List[torch.Tensor] = []
+        for row_idx, processor, seq_input_ids in zip(row_indices, processors,
+                                                     input_ids):
+            allowed_tokens = processor._get_allowed_tokens(
+                seq_input_ids, vocab_size, logits.device)
+            if allowed_tokens is None:
+                continue
+            allowed_tokens_list.append(allowed_tokens)
+            num_allowed_tokens.append(allowed_tokens.numel())
+            masked_rows.append(row_idx)
+
+        if not masked_rows:
+            return logits
+
+        # Mask every token of the guided rows except the allowed ones. The
+        # mask only covers the guided rows, which are gathered, masked and
+        # written back; the other rows are left untouched.
+        pin_memory = is_pin_memory_available()
+        rows = async_tensor_h2d(masked_rows, torch.int64, logits.device,
+                                pin_memory)
+        mask = torch.ones((len(masked_rows), vocab_size),
+                          dtype=torch.bool,
+                          device=logits.device)
+        # Passing `output_size` keeps repeat_interleave from synchronizing
+        # with the device to find the size of its output.
+        repeats = async_tensor_h2d(num_allowed_tokens, torch.int64,
+                                   logits.device, pin_memory)
+        mask_rows = torch.arange(len(masked_rows), device=logits.device)
+        mask_rows = mask_rows.repeat_interleave(
+            repeats, output_size=sum(num_allowed_tokens))
+        mask.index_put_((mask_rows, torch.cat(allowed_tokens_list)),
+                        mask.new_zeros(()))
+        guided_logits = logits.index_select(0, rows).masked_fill(
+            mask, -torch.inf)
+        if current_platform.is_hpu():
+            # See the masked_fill_() workaround in __call__.
+            logits = logits.index_copy(0, rows, guided_logits)
+        else:
+            logits.index_copy_(0, rows, guided_logits)
+        return logits
+
+    def _get_allowed_tokens(self, input_ids: List[int], vocab_size: int,
+                            device: torch.device) -> Optional[torch.Tensor]:
+        """Advance the FSM with the last token of `input_ids` and return the
+        ids of the tokens allowed next on `device`, or None if the logits
+        should be left untouched."""
 
         # Skip the structured logits processing if reasoning is not finished.
         # reasoner is not None only when `--enable-reasoning` is set.
         if self._reasoner is not None:
             if not self._reasoner.is_reasoning_end(input_ids):
-                return scores
+                return None
             else:
                 # Remove the reasoning tokens from the input_ids
                 # We need this because our implementation relies on the
@@ -94,49 +227,90 @@ class BaseLogitsProcessor:
                 self._fsm_state[seq_id] = CFGState(
                     parser_state=self._guide.parser.parse(""), prev_token=None)
 
-        instruction = self._guide.get_next_instruction(
-            state=self._fsm_state[seq_id])
+        state = self._fsm_state[seq_id]
+        # The allowed tokens of an FSM state never change, so keep them on
+        # the device instead of copying them over on every step. States of
+        # CFG guides are parser states and are not cached.
+        cache = None
+        if isinstance(state, int):
+            with self._allowed_tokens_cache_lock:
+                cache = self._allowed_tokens_caches.get(self._guide)
+                if cache is None:
+                    cache = LRUCache(self._DEVICE_CACHE_MAX_TOKENS,
+                                     getsizeof=torch.numel)
+                    self._allowed_tokens_caches[self._guide] = cache
+                allowed_tokens = cache.get((state, device))
+            if allowed_tokens is not None:
+                return allowed_tokens
+
+        instruction = self._guide.get_next_instruction(state=state)
 
         if type(instruction) == Generate:  # noqa: E721
             allowed_tokens = instruction.tokens
         elif type(instruction) == Write:  # noqa: E721
             # TODO: support fast forward tokens
-            allowed_tokens = [instruction.tokens[0]]
+            allowed_tokens = instruction.tokens[:1]
         else:
             raise TypeError(
                 f"Unsupported instruction type {type(instruction)}")
 
-        mask = torch.full((scores.shape[-1], ),
-                          -torch.inf,
-                          device=scores.device)
         # The tokenizer may support more token ids than the model can generate,
         # eg. Llama 3.2 Vision models have an `<|image|>` token with id 128256
         # but scores.shape == torch.Size([128256])
-        # Using NumPy is faster for filtering token ids
-        allowed_tokens = np.array(allowed_tokens, dtype=np.int64)
-        allowed_tokens = torch.tensor(allowed_tokens, device=scores.device)
-        allowed_tokens = allowed_tokens.masked_select(
-            allowed_tokens < scores.shape[-1])
-        mask.index_fill_(0, allowed_tokens, 0)
-        if current_platform.is_hpu():
-            # Workaround for HPU bug where add_() raise RuntimeError:
-            # synNodeCreateWithId failed for node: strided_insert
-            # with synStatus 1 [Invalid argument], hopefully it will
-            # be fixed in the future releases of the HPU runtime.
-            scores = scores.add(mask)
-        else:
-            scores.add_(mask)
-        return scores
+        # The guide already returns the token ids as a CPU tensor, so filter
+        # them on the host before the copy to the device. Filtering on the
+        # device would make `masked_select` synchronize the stream.
+        allowed_tokens = torch.as_tensor(allowed_tokens, dtype=torch.int64)
+        allowed_tokens = allowed_tokens[allowed_tokens < vocab_size]
+        # Stage the ids in pinned memory so that the copy does not block the
+        # host while the device is still busy with the forward pass.
+        if device.type != "cpu" and is_pin_memory_available():
+            allowed_tokens = allowed_tokens.pin_memory()
+        allowed_tokens = allowed_tokens.to(device, non_blocking=True)
+        if (cache is not None
+                and allowed_tokens.numel() <= self._DEVICE_CACHE_MAX_TOKENS):
+            with self._allowed_tokens_cache_lock:
+                cache.put((state, device), allowed_tokens)
+                while len(cache) > self._DEVICE_CACHE_MAX_STATES:
+                    cache.remove_oldest()
+        return allowed_tokens
 
 
 class RegexLogitsProcessor(BaseLogitsProcessor):
 
+    # Compiled guides of the most recently used regexes, keyed by the regex
+    # and the memoized adapted tokenizer. Regex guides are stateless, so they
+    # can be shared by every processor using the same regex.
+    _GUIDE_CACHE_SIZE = 128
+    _guide_cache: Dict[Tuple[str, PreTrainedTokenizerBase], Guide] = {}
+    _guide_cache_lock = threading.Lock()
+
     @classmethod
-    @cache()
     def _get_guide(cls, regex_string: str,
                    tokenizer: PreTrainedTokenizerBase) -> Guide:
+        key = (regex_string, _adapt_tokenizer(tokenizer))
+        with cls._guide_cache_lock:
+            guide = cls._guide_cache.get(key)
+        if guide is None:
+            guide = cls._compile_guide(regex_string, tokenizer)
+            with cls._guide_cache_lock:
+                if len(cls._guide_cache) >= cls._GUIDE_CACHE_SIZE:
+                    # Evict the oldest entry.
+                    del cls._guide_cache[next(iter(cls._guide_cache))]
+                cls._guide_cache[key] = guide
+        return guide
+
+    @classmethod
+    @cache()
+    def _compile_guide(cls, regex_string: str,
+                       tokenizer: PreTrainedTokenizerBase) -> Guide:
         tokenizer = _adapt_tokenizer(tokenizer)
-        return RegexGuide.from_regex(regex_string, tokenizer)
+        # outlines' RegexGuide only adds its own cached states mapping on
+        # top of the outlines_core one, so use the latter directly.
+        return RegexGuide.from_regex(
+            regex_string,
+            tokenizer,
+            _create_states_mapping=_create_states_mapping)
 
     def __init__(
         self,
@@ -158,6 +332,14 @@ class RegexLogitsProcessor(BaseLogitsProcessor):
             RegexLogitsProcessor._get_guide(regex_string, tokenizer), reasoner)
 
 
+@lru_cache(maxsize=256)
+def _build_regex_from_schema(schema: str,
+                             whitespace_pattern: Optional[str]) -> str:
+    """Memoized `build_regex_from_schema`. Clients tend to send the same
+    schemas over and over, and converting a large schema is expensive."""
+    return build_regex_from_schema(schema, whitespace_pattern)
+
+
 class JSONLogitsProcessor(RegexLogitsProcessor):
 
     def __init__(self, schema: Union[str, Dict, BaseModel],
@@ -190,7 +372,7 @@ class JSONLogitsProcessor(RegexLogitsProcessor):
                 f"Cannot parse schema {schema}. The schema must be either "
                 f"a Pydantic object, a dictionary or a string that contains "
                 f"the JSON Schema specification")
-        regex_string = build_regex_from_schema(schema_str, whitespace_pattern)
+        regex_string = _build_regex_from_schema(schema_str, whitespace_pattern)
         super().__init__(regex_string, tokenizer, reasoner)
 
 
@@ -239,11 +421,7 @@ def _adapt_tokenizer(tokenizer: PreTrainedTokenizerBase):
     tokenizer.vocabulary = tokenizer.get_vocab()
     tokenizer.special_tokens = set(tokenizer.all_special_tokens)
 
-    def convert_token_to_string(token: str) -> str:
-        from transformers.file_utils import SPIECE_UNDERLINE
-
-        string = tokenizer.convert_tokens_to_string([token])
-
+    def add_missing_space(token: str, string: str) -> str:
         # A hack to handle missing spaces to HF's Llama tokenizers
         if (type(token) is str and token.startswith(SPIECE_UNDERLINE)
                 or token == "<0x20>"):
@@ -251,6 +429,28 @@ def _adapt_tokenizer(tokenizer: PreTrainedTokenizerBase):
 
         return string
 
+    def convert_token_to_string(token: str) -> str:
+        return add_missing_space(token,
+                                 tokenizer.convert_tokens_to_string([token]))
+
+    def convert_tokens_to_strings(tokens: List[str],
+                                  token_ids: List[int]) -> List[str]:
+        """Same as `convert_token_to_string` for several tokens at once,
+        given along with their ids.
+
+        Fast tokenizers decode all of them in a single call into their Rust
+        backend instead of one call per token.
+        """
+        if not isinstance(tokenizer, PreTrainedTokenizerFast):
+            return [convert_token_to_string(token) for token in tokens]
+
+        strings = tokenizer.backend_tokenizer.decode_batch(
+            [[token_id] for token_id in token_ids], skip_special_tokens=False)
+        return [
+            add_missing_space(token, string)
+            for token, string in zip(tokens, strings)
+        ]
+
     def change_decoder(
         decoder: Callable[[List[int]],
                           str]) -> Callable[[List[int]], List[str]]:
@@ -265,7 +465,159 @@ def _adapt_tokenizer(tokenizer: PreTrainedTokenizerBase):
         return new_decoder
 
     tokenizer.convert_token_to_string = convert_token_to_string
+    tokenizer.convert_tokens_to_strings = convert_tokens_to_strings
     tokenizer.decode = change_decoder(tokenizer.decode)
     setattr(tokenizer, "_outlines_adapted", True)  # noqa: B010
 
     return tokenizer
+
+
+def _create_states_mapping(
+    regex_string: str,
+    tokenizer: PreTrainedTokenizerBase,
+    regex_parser: Callable[[str], Any],
+    frozen_tokens: Optional[List[str]] = None,
+) -> Tuple[Index, Set[int], Set[int]]:
+    """Build the token-level index of a regex.
+
+    Same as `outlines_core.fsm.guide.create_states_mapping`, except that the
+    reduced vocabulary is taken from `_get_reduced_vocabulary` instead of
+    being looked up in outlines_core's global cache.
+    """
+    frozen_tokens = frozen_tokens or []
+    fsm = regex_parser(regex_string).to_fsm()
+    byte_fsm = make_byte_level_fsm(fsm.reduce(),
+                                   keep_utf8=True,
+                                   frozen_tokens=frozen_tokens)
+    regex_fsm, _ = make_deterministic_fsm(byte_fsm)
+    _, empty_token_ids, vocabulary = _get_reduced_vocabulary(tokenizer)
+    states_to_token_maps = Index(regex_fsm.fsm_info, vocabulary,
+                                 tokenizer.eos_token_id,
+                                 frozenset(frozen_tokens))
+    return states_to_token_maps, empty_token_ids, regex_fsm.finals
+
+
+# Reduced vocabulary of a tokenizer, the ids of its tokens that decode to
+# the empty string, and the same vocabulary converted for outlines_core.
+_ReducedVocabulary = Tuple[Dict[str, List[int]], Set[int], Vocabulary]
+
+
+def _get_reduced_vocabulary(
+        tokenizer: PreTrainedTokenizerBase) -> _ReducedVocabulary:
+    """Get the reduced vocabulary of an adapted tokenizer.
+
+    The result is stored on the tokenizer, which `_adapt_tokenizer`
+    memoizes, so that every guide compiled for that tokenizer shares it
+    without walking the vocabulary or building the outlines_core
+    `Vocabulary` again.
+    """
+    reduced_vocabulary = getattr(tokenizer, "_outlines_reduced_vocabulary",
+                                 None)
+    if reduced_vocabulary is not None:
+        return reduced_vocabulary
+
+    vocabulary, empty_token_ids = _reduced_vocabulary(tokenizer)
+    reduced_vocabulary = (vocabulary, empty_token_ids,
+                          Vocabulary.from_dict(vocabulary))
+    tokenizer._outlines_reduced_vocabulary = reduced_vocabulary
+    return reduced_vocabulary
+
+
+def _has_byte_level_decoder(tokenizer: PreTrainedTokenizerBase) -> bool:
+    """Whether the tokenizer is a byte-level BPE tokenizer, e.g. GPT-2,
+    Llama 3 or Qwen, whose tokens decode through a plain `ByteLevel`
+    decoder."""
+    return (isinstance(tokenizer, PreTrainedTokenizerFast) and isinstance(
+        tokenizer.backend_tokenizer.decoder, decoders.ByteLevel))
+
+
+def _reduced_vocabulary(
+    tokenizer: PreTrainedTokenizerBase
+) -> Tuple[Dict[str, List[int]], Set[int]]:
+    """Create a map from decoded vocabulary tokens to lists of equivalent
+    token ids, along with the set of token ids that decode to the empty
+    string.
+
+    Adapted from `outlines_core.fsm.regex.reduced_vocabulary`.
+    """
+    empty_token_ids: Set[int] = set()
+    vocabulary: DefaultDict[str, List[int]] = defaultdict(list)
+    # This loop runs once per vocabulary entry, so resolve everything that
+    # does not depend on the token up front.
+    special_tokens = frozenset(tokenizer.special_tokens)
+    match_replacement_seq = re_replacement_seq.match
+    byte_level = _has_byte_level_decoder(tokenizer)
+    # Tokens that have to go through the tokenizer to be decoded, so that
+    # they can all be decoded at once.
+    undecoded_tokens: List[Union[str, bytes]] = []
+    undecoded_token_ids: List[int] = []
+    for token, token_idx in tokenizer.vocabulary.items():
+        if token in special_tokens:
+            continue
+
+        if type(token) is str and token.isascii() and token.isalnum():
+            # Alphanumeric ASCII tokens decode to themselves with the
+            # byte-level, metaspace and wordpiece decoders, so there is no
+            # need for a round-trip through the tokenizer.
+            vocabulary[token].append(token_idx)
+            continue
+
+        if byte_level and token and _GPT2_UNICODE_CHARS.issuperset(token):
+            # The characters of byte-level BPE tokens each stand for a byte,
+            # so they can be decoded by inverting that mapping. Tokens that
+            # are not valid utf-8 on their own are mapped to byte symbols,
+            # like in the gpt2-like branch below.
+            token_bytes = token.translate(_GPT2_UNICODE_TO_LATIN1).encode(
+                "latin-1")
+            token_str = token_bytes.decode("utf-8", errors="replace")
+            if "\ufffd" in token_str:
+                token_str = "".join([_BYTE_SYMBOLS[b] for b in token_bytes])
+            vocabulary[token_str].append(token_idx)
+            continue
+
+        undecoded_tokens.append(token)
+        undecoded_token_ids.append(token_idx)
+
+    token_strs = tokenizer.convert_tokens_to_strings(undecoded_tokens,
+                                                     undecoded_token_ids)
+    for token, token_idx, token_str in zip(undecoded_tokens,
+                                           undecoded_token_ids, token_strs):
+        if token_str:
+            if type(token) is bytes:
+                # Handle BPE tokenizers where the tokens are directly stored
+                # as bytes.
+                # https://github.com/QwenLM/Qwen/blob/main/tokenization_note.md#regular-tokens  # noqa: E501
+                token_str = "".join([_BYTE_SYMBOLS[b] for b in token])
+
+            elif "\ufffd" in token_str and not match_replacement_seq(token):
+                # invalid utf-8 sequences are replaced with \ufffd, but there
+                # might also be tokens specifically for \ufffd, \ufffd\ufffd,
+                # etc.
+                # llama-like tokenizers have <0xXX> tokens for all
+                # bytes >= 0x80 and represent all incomplete utf-8
+                # sequences using such tokens
+                llama_byte_symbol = _LLAMA_BYTE_TOKEN_SYMBOLS.get(token)
+                if llama_byte_symbol is not None:
+                    token_str = llama_byte_symbol
+                else:
+                    # gpt2-like tokenizers have multi-byte tokens that can
+                    # have a mix of full and incomplete utf-8 characters,
+                    # for example, b` \xf0` can be one token; these
+                    # tokenizers map each byte to a valid utf-8 character
+                    token_bytes = [
+                        _GPT2_UNICODE_TO_BYTES.get(c) for c in token
+                    ]
+                    if None in token_bytes:
+                        raise RuntimeError(
+                            f"Cannot convert token `{token}` ({token_idx}) "
+                            f"to bytes: {token_str}")
+                    token_str = "".join(
+                        [_BYTE_SYMBOLS[b] for b in token_bytes])
+
+            vocabulary[token_str].append(token_idx)
+        else:
+            empty_token_ids.add(token_idx)
+
+    # Stop creating entries on lookup now that the vocabulary is complete.
+    vocabulary.default_factory = None
+    return vocabulary, empty_token_ids
@@ -2,58 +2,64 @@
 
 import re
 
+# Patterns used to parse and convert Lark grammars, compiled once instead of
+# on every line of every grammar.
+_COMMENT_RE = re.compile(r'(#|//).*$')
+_QUOTED_STRING_RE = re.compile(r'"[^"]*"')
+_GRAMMAR_OPERATOR_RE = re.compile(r'[+*?()|\[\]{}]')
+_RULE_NAME_RE = re.compile(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b')
+_SINGLE_QUOTED_STRING_RE = re.compile(r"'([^']*)'")
+
+# JSON schema keywords that xgrammar does not support, by the type of the
+# schema they apply to.
+_XGRAMMAR_UNSUPPORTED_KEYWORDS = {
+    "integer":
+    frozenset(("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+               "multipleOf")),
+    "number":
+    frozenset(("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+               "multipleOf")),
+    "array":
+    frozenset(("uniqueItems", "contains", "minContains", "maxContains",
+               "minItems", "maxItems")),
+    "string":
+    frozenset(("minLength", "maxLength", "format")),
+    "object":
+    frozenset(("minProperties", "maxProperties", "propertyNames",
+               "patternProperties")),
+}
+
 
 def has_xgrammar_unsupported_json_features(schema: dict) -> bool:
     """Check if JSON schema contains features unsupported by xgrammar."""
-
-    def check_object(obj: dict) -> bool:
+    # Walk the schema with an explicit stack rather than recursion, as large
+    # schemas can be deeply nested.
+    stack = [schema]
+    while stack:
+        obj = stack.pop()
         if not isinstance(obj, dict):
-            return False
+            continue
 
         # Check for pattern restrictions
         if "pattern" in obj:
             return True
 
-        # Check for numeric ranges
-        if obj.get("type") in ("integer", "number") and any(
-                key in obj for key in [
-                    "minimum", "maximum", "exclusiveMinimum",
-                    "exclusiveMaximum", "multipleOf"
-                ]):
-            return True
-
-        # Check for array unsupported keywords
-        if obj.get("type") == "array" and any(key in obj for key in [
-                "uniqueItems", "contains", "minContains", "maxContains",
-                "minItems", "maxItems"
-        ]):
-            return True
-
-        # Unsupported keywords for strings
-        if obj.get("type") == "string" and any(
-                key in obj for key in ["minLength", "maxLength", "format"]):
-            return True
-
-        # Unsupported keywords for objects
-        if obj.get("type") == "object" and any(key in obj for key in [
-                "minProperties", "maxProperties", "propertyNames",
-                "patternProperties"
-        ]):
-            return True
+        # Check for keywords unsupported for the type of the schema, such as
+        # numeric ranges or string lengths
+        schema_type = obj.get("type")
+        if isinstance(schema_type, str):
+            unsupported = _XGRAMMAR_UNSUPPORTED_KEYWORDS.get(schema_type)
+            if unsupported is not None and not unsupported.isdisjoint(obj):
+                return True
 
-        # Recursively check all nested objects and arrays
+        # Check all nested objects and arrays
         for value in obj.values():
             if isinstance(value, dict):
-                if check_object(value):
-                    return True
+                stack.append(value)
             elif isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict) and check_object(item):
-                        return True
+                stack.extend(item for item in value if isinstance(item, dict))
 
-        return False
-
-    return check_object(schema)
+    return False
 
 
 def has_lmf_unsupported_json_features(schema: dict) -> bool:
@@ -68,28 +74,26 @@ def has_lmf_unsupported_json_features(schema: dict) -> bool:
             "pattern": "^[A-D]$"  # Regex pattern
         },
     """
-
-    def check_object(obj: dict) -> bool:
+    # Walk the schema with an explicit stack rather than recursion, as large
+    # schemas can be deeply nested.
+    stack = [schema]
+    while stack:
+        obj = stack.pop()
         if not isinstance(obj, dict):
-            return False
+            continue
 
         # Check for pattern restrictions
         if "pattern" in obj:
             return True
 
-        # Recursively check all nested objects and arrays
+        # Check all nested objects and arrays
         for value in obj.values():
             if isinstance(value, dict):
-                if check_object(value):
-                    return True
+                stack.append(value)
             elif isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict) and check_object(item):
-                        return True
+                stack.extend(item for item in value if isinstance(item, dict))
 
-        return False
-
-    return check_object(schema)
+    return False
 
 
 def grammar_is_likely_lark(grammar_str: str) -> bool:
@@ -113,7 +117,7 @@ def grammar_is_likely_lark(grammar_str: str) -> bool:
 
     for line in grammar_str.split('\n'):
         # Remove both comment styles
-        line = re.sub(r'(#|//).*$', '', line).strip()
+        line = _COMMENT_RE.sub('', line).strip()
         if not line:
             continue
 
@@ -155,7 +159,7 @@ def convert_lark_to_gbnf(grammar_str: str) -> str:
 
     def clean_line(line: str) -> str:
         """Remove comments and whitespace from line."""
-        return re.sub(r'(#|//).*$', '', line).strip()
+        return _COMMENT_RE.sub('', line).strip()
 
     def check_quotes(text: str, rule_name: str, line_num: int) -> None:
         """Validate quote matching in text."""
@@ -166,9 +170,9 @@ def convert_lark_to_gbnf(grammar_str: str) -> str:
     def extract_references(text: str) -> set:
         """Extract rule references from text."""
         # Remove quoted strings and special characters
-        text = re.sub(r'"[^"]*"', '', text)
-        text = re.sub(r'[+*?()|\[\]{}]', ' ', text)
-        return set(re.findall(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b', text))
+        text = _QUOTED_STRING_RE.sub('', text)
+        text = _GRAMMAR_OPERATOR_RE.sub(' ', text)
+        return set(_RULE_NAME_RE.findall(text))
 
     # First pass: Find root rule and validate rule definitions
     lines = [clean_line(line) for line in grammar_str.split('\n')]
@@ -216,7 +220,7 @@ def convert_lark_to_gbnf(grammar_str: str) -> str:
                 current_rule = name.strip().strip('?')
 
                 check_quotes(definition, f"rule '{current_rule}'", line_num)
-                definition = re.sub(r"'([^']*)'", r'"\1"', definition)
+                definition = _SINGLE_QUOTED_STRING_RE.sub(r'"\1"', definition)
                 referenced_rules.update(extract_references(definition))
                 current_definition = [definition.strip()]
 
@@ -228,7 +232,7 @@ def convert_lark_to_gbnf(grammar_str: str) -> str:
                 alt_def = line[1:].strip()
                 check_quotes(alt_def, f"alternative for rule '{current_rule}'",
                              line_num)
-                alt_def = re.sub(r"'([^']*)'", r'"\1"', alt_def)
+                alt_def = _SINGLE_QUOTED_STRING_RE.sub(r'"\1"', alt_def)
                 referenced_rules.update(extract_references(alt_def))
                 current_definition.append(alt_def)
 
@@ -247,3 +251,21 @@ def convert_lark_to_gbnf(grammar_str: str) -> str:
                          f"{', '.join(sorted(undefined_rules))}")
 
     return '\n'.join(output_lines)
+
+
+# Separator used to escape all choices at once. It is not escaped by
+# `re.escape`, so it can be swapped for the alternation afterwards.
+_CHOICE_SEPARATOR = "\x1f"
+
+
+def choice_as_regex(choice: list[str]) -> str:
+    """Build a regex matching exactly one of the given choices."""
+    choices = [str(c) for c in choice]
+    joined = _CHOICE_SEPARATOR.join(choices)
+    if joined.count(_CHOICE_SEPARATOR) != len(choices) - 1:
+        # A choice contains the separator itself; escape them one by one.
+        escaped = "|".join(re.escape(c) for c in choices)
+    else:
+        # Escape all the choices in a single call rather than one per choice.
+        escaped = re.escape(joined).replace(_CHOICE_SEPARATOR, "|")
+    return "(" + escaped + ")"
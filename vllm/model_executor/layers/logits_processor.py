@@ -2,7 +2,7 @@
 """A layer that compute logits from hidden_stats."""
 import inspect
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -145,6 +145,10 @@ def _apply_logits_processors(
     found_logits_processors = False
     logits_processed = 0
     logits_row_ids_and_logits_row_futures = []
+    # Rows whose only logits processor supports batched application, grouped
+    # by processor type, as (row indices, processors, past token ids).
+    batched_logits_processors: Dict[Any, Tuple[List[int], List[Any],
+                                               List[List[int]]]] = {}
     for seq_group in sampling_metadata.seq_groups:
         seq_ids = seq_group.seq_ids
         sampling_params = seq_group.sampling_params
@@ -158,7 +162,15 @@ def _apply_logits_processors(
                 past_tokens_ids = seq_group.seq_data[seq_id].output_token_ids
                 prompt_tokens_ids = seq_group.seq_data[seq_id].prompt_token_ids
 
-                if _logits_processor_threadpool is not None:
+                if (len(logits_processors) == 1
+                        and hasattr(logits_processors[0], "apply_batch")):
+                    rows, processors, input_ids = \
+                        batched_logits_processors.setdefault(
+                            type(logits_processors[0]), ([], [], []))
+                    rows.append(logits_row_idx)
+                    processors.append(logits_processors[0])
+                    input_ids.append(past_tokens_ids)
+                elif _logits_processor_threadpool is not None:
                     logits_row_ids_and_logits_row_futures.append(
                         (logits_row_idx,
                          _logits_processor_threadpool.submit(
@@ -174,6 +186,10 @@ def _apply_logits_processors(
         logits_processed += len(seq_group.sample_indices) + len(
             seq_group.prompt_logprob_indices)
 
+    for processor_cls, (rows, processors,
+                        input_ids) in batched_logits_processors.items():
+        logits = processor_cls.apply_batch(logits, rows, processors, input_ids)
+
     for logits_row_idx, future in logits_row_ids_and_logits_row_futures:
         logits[logits_row_idx] = future.result()
 
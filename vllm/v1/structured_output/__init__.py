@@ -24,6 +24,13 @@ logger = init_logger(__name__)
 class StructuredOutputManager:
     """Engine-level manager for structured output requests."""
 
+    # Batches with at least this many grammars to advance have their bitmask
+    # filled from a thread pool, in chunks of the given size. These are
+    # untuned, conservative values: typical batches keep the sequential loop
+    # and each pool task fills enough rows to amortize handing it off.
+    _FILL_BITMASK_PARALLEL_THRESHOLD = 128
+    _FILL_BITMASK_CHUNK_SIZE = 16
+
     def __init__(self, vllm_config: VllmConfig):
         self.backend: Optional[StructuredOutputBackend] = None
         self.vllm_config = vllm_config
@@ -36,6 +43,13 @@ class StructuredOutputManager:
         max_workers = max(1, (multiprocessing.cpu_count() + 1) // 2)
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
 
+        # xgrammar releases the GIL while filling a bitmask row, so the rows
+        # of large batches can be filled concurrently. This uses a separate
+        # pool so that pending grammar compilations cannot delay the bitmask.
+        self._fill_bitmask_executor = ThreadPoolExecutor(
+            max_workers=max_workers)
+        self._fill_bitmask_in_parallel = False
+
     def grammar_init(self, request: Request) -> None:
         if request.structured_output_request is None:
             return
@@ -51,6 +65,7 @@ class StructuredOutputManager:
                     XgrammarBackend)
 
                 self.backend = XgrammarBackend(self.vllm_config)
+                self._fill_bitmask_in_parallel = True
             elif backend_name == "guidance":
                 self.backend = GuidanceBackend(self.vllm_config)
             else:
@@ -95,11 +110,31 @@ class StructuredOutputManager:
         # position in the batch. Resize the bitmask down to the size of
         # the batch.
         bitmask_tensor = self._grammar_bitmask
+        grammars: list[tuple[StructuredOutputGrammar, int]] = []
         for req_id, batch_index in structured_output_request_ids.items():
             request = requests[req_id].structured_output_request
-            assert request is not None and request.grammar is not None
-            if not request.grammar.is_terminated():
-                request.grammar.fill_bitmask(bitmask_tensor, batch_index)
+            assert request is not None
+            grammar = request.grammar
+            assert grammar is not None
+            if not grammar.is_terminated():
+                grammars.append((grammar, batch_index))
+
+        if (self._fill_bitmask_in_parallel
+                and len(grammars) >= self._FILL_BITMASK_PARALLEL_THRESHOLD):
+            # Every grammar writes to its own row, so the chunks can be
+            # filled concurrently.
+            chunk_size = self._FILL_BITMASK_CHUNK_SIZE
+            futures = [
+                self._fill_bitmask_executor.submit(
+                    self._fill_bitmask, bitmask_tensor,
+                    grammars[start:start + chunk_size])
+                for start in range(0, len(grammars), chunk_size)
+            ]
+            for future in futures:
+                future.result()
+        else:
+            self._fill_bitmask(bitmask_tensor, grammars)
+
         if batch_len < self._grammar_bitmask.shape[0]:
             bitmask_tensor = self._grammar_bitmask[:batch_len]
 
@@ -107,3 +142,11 @@ class StructuredOutputManager:
         # np.ndarray, because that is much more efficient for serialization
         # and deserialization when sending this to the GPU workers.
         return bitmask_tensor.numpy()
+
+    @staticmethod
+    def _fill_bitmask(
+        bitmask: torch.Tensor,
+        grammars: list[tuple[StructuredOutputGrammar, int]],
+    ) -> None:
+        for grammar, batch_index in grammars:
+            grammar.fill_bitmask(bitmask, batch_index)
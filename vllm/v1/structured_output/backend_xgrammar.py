@@ -2,6 +2,7 @@
 
 import json
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import TYPE_CHECKING, Any
 
 import torch
@@ -132,7 +133,7 @@ class XgrammarGrammar(StructuredOutputGrammar):
     vocab_size: int
     matcher: xgr.GrammarMatcher = field(hash=False)
     ctx: xgr.CompiledGrammar = field(hash=False)
-    num_processed_tokens: int = field(default_factory=lambda: 0,
+    num_processed_tokens: int = field(default=0,
                                       repr=False,
                                       hash=False,
                                       init=False)
@@ -143,13 +144,17 @@ class XgrammarGrammar(StructuredOutputGrammar):
         Returns True if the FSM was advanced successfully.
         Returns False if the FSM failed to advance.
         """
-        for token in tokens:
-            if not self.matcher.accept_token(token):
+        # xgrammar has no bulk accept, so keep the per-token loop as tight as
+        # possible: bind the method once and update the counter once.
+        accept_token = self.matcher.accept_token
+        for num_accepted, token in enumerate(tokens):
+            if not accept_token(token):
+                self.num_processed_tokens += num_accepted
                 logger.error(
                     "Failed to advance FSM for request %s "
                     "for tokens %s. Please file an issue.", request_id, token)
                 return False
-            self.num_processed_tokens += 1
+        self.num_processed_tokens += len(tokens)
         return True
 
     def fill_bitmask(self, bitmask: torch.Tensor, idx: int) -> None:
@@ -163,54 +168,86 @@ class XgrammarGrammar(StructuredOutputGrammar):
         self.matcher.reset()
 
 
+# JSON schema keywords that xgrammar does not support, by the type of the
+# schema they apply to.
+_XGRAMMAR_UNSUPPORTED_KEYWORDS: dict[str, frozenset[str]] = {
+    "integer":
+    frozenset(("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+               "multipleOf")),
+    "number":
+    frozenset(("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+               "multipleOf")),
+    "array":
+    frozenset(("uniqueItems", "contains", "minContains", "maxContains",
+               "minItems", "maxItems")),
+    "string":
+    frozenset(("format", )),
+    "object":
+    frozenset(("minProperties", "maxProperties", "propertyNames",
+               "patternProperties")),
+}
+
+
 def has_xgrammar_unsupported_json_features(schema: dict[str, Any]) -> bool:
     """Check if JSON schema contains features unsupported by xgrammar."""
-
-    def check_object(obj: dict[str, Any]) -> bool:
+    # Walk the schema with an explicit stack rather than recursion, as large
+    # schemas can be deeply nested.
+    stack: list[Any] = [schema]
+    while stack:
+        obj = stack.pop()
         if not isinstance(obj, dict):
-            return False
+            continue
 
         # Check for pattern restrictions
         if "pattern" in obj:
             return True
 
-        # Check for numeric ranges
-        if obj.get("type") in ("integer", "number") and any(
-                key in obj
-                for key in ("minimum", "maximum", "exclusiveMinimum",
-                            "exclusiveMaximum", "multipleOf")):
-            return True
-
-        # Check for array unsupported keywords
-        if obj.get("type") == "array" and any(
-                key in obj
-                for key in ("uniqueItems", "contains", "minContains",
-                            "maxContains", "minItems", "maxItems")):
-            return True
-
-        # Unsupported keywords for strings
-        if obj.get("type") == "string" and "format" in obj:
-            return True
-
-        # Unsupported keywords for objects
-        if obj.get("type") == "object" and any(
-                key in obj for key in ("minProperties", "maxProperties",
-                                       "propertyNames", "patternProperties")):
-            return True
+        # Check for keywords unsupported for the type of the schema, such as
+        # numeric ranges or string formats
+        schema_type = obj.get("type")
+        if isinstance(schema_type, str):
+            unsupported = _XGRAMMAR_UNSUPPORTED_KEYWORDS.get(schema_type)
+            if unsupported is not None and not unsupported.isdisjoint(obj):
+                return True
 
-        # Recursively check all nested objects and arrays
+        # Check all nested objects and arrays
         for value in obj.values():
             if isinstance(value, dict):
-                if check_object(value):
-                    return True
+                stack.append(value)
             elif isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict) and check_object(item):
-                        return True
+                stack.extend(item for item in value if isinstance(item, dict))
 
-        return False
+    return False
 
-    return check_object(schema)
+
+@lru_cache(maxsize=1024)
+def _check_regex_is_buildable(regex: str) -> None:
+    """Raise if xgrammar cannot build a grammar from `regex`.
+
+    Clients tend to send the same patterns over and over, so successful
+    checks are memoized. Failures raise and are therefore not cached.
+    """
+    xgr.Grammar.from_regex(regex)
+
+
+@lru_cache(maxsize=1024)
+def _check_ebnf_is_buildable(grammar: str) -> None:
+    """Raise if xgrammar cannot parse the EBNF `grammar`.
+
+    Memoized like `_check_regex_is_buildable`. This also covers the
+    grammars built from `choice` requests.
+    """
+    xgr.Grammar.from_ebnf(grammar)
+
+
+@lru_cache(maxsize=1024)
+def _json_str_has_unsupported_features(schema: str) -> bool:
+    """Parse a JSON schema string and check it for features unsupported by
+    xgrammar, memoized per schema string."""
+    try:
+        return has_xgrammar_unsupported_json_features(json.loads(schema))
+    except json.JSONDecodeError as e:
+        raise ValueError("Invalid JSON grammar specification.") from e
 
 
 def validate_xgrammar_grammar(sampling_params: SamplingParams) -> None:
@@ -225,7 +262,7 @@ def validate_xgrammar_grammar(sampling_params: SamplingParams) -> None:
 
     if gd_params.regex:
         try:
-            xgr.Grammar.from_regex(gd_params.regex)
+            _check_regex_is_buildable(gd_params.regex)
         except Exception as err:
             raise ValueError("Failed to transform regex into a grammar: "
                              f"{err}") from err
@@ -233,7 +270,7 @@ def validate_xgrammar_grammar(sampling_params: SamplingParams) -> None:
     if gd_params.choice:
         choice_grammar = choice_as_grammar(gd_params.choice)
         try:
-            xgr.Grammar.from_ebnf(choice_grammar)
+            _check_ebnf_is_buildable(choice_grammar)
         except Exception as err:
             raise ValueError("Failed to transform choices into a grammar: "
                              "{err}") from err
@@ -243,14 +280,12 @@ def validate_xgrammar_grammar(sampling_params: SamplingParams) -> None:
 
     if gd_params.json:
         if isinstance(gd_params.json, str):
-            try:
-                schema = json.loads(gd_params.json)
-            except json.JSONDecodeError as e:
-                raise ValueError("Invalid JSON grammar specification.") from e
+            unsupported = _json_str_has_unsupported_features(gd_params.json)
         else:
-            schema = gd_params.json
+            unsupported = has_xgrammar_unsupported_json_features(
+                gd_params.json)
 
-        if has_xgrammar_unsupported_json_features(schema):
+        if unsupported:
             raise ValueError("The provided JSON schema contains features not "
                              "supported by xgrammar.")
         return
@@ -267,6 +302,6 @@ def validate_xgrammar_grammar(sampling_params: SamplingParams) -> None:
         # Test parsing EBNF grammar, possibly already converted from Lark
         try:
             # parse the grammar, but we aren't compiling it.
-            xgr.Grammar.from_ebnf(gd_params.grammar)
+            _check_ebnf_is_buildable(gd_params.grammar)
         except Exception as e:
             raise ValueError("Invalid grammar specification.") from e
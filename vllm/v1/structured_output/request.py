@@ -22,10 +22,12 @@ class StructuredOutputRequest:
                              StructuredOutputGrammar]] = None
 
     def _check_grammar_completion(self) -> bool:
-        # NOTE: We have to lazy import to gate circular imports
-        from vllm.v1.request import RequestStatus
-
         if isinstance(self._grammar, Future):
+            # NOTE: We have to lazy import to gate circular imports. This is
+            # only needed until the grammar is compiled, so keep it out of
+            # the per-step path taken once the grammar is ready.
+            from vllm.v1.request import RequestStatus
+
             try:
                 # We will check whether the future is ready within 100 us
                 self._grammar = self._grammar.result(timeout=0.0001)
@@ -4,6 +4,14 @@ from __future__ import annotations
 
 import re
 
+# Patterns used to parse and convert Lark grammars, compiled once instead of
+# on every line of every grammar.
+_COMMENT_RE = re.compile(r'(#|//).*$')
+_QUOTED_STRING_RE = re.compile(r'"[^"]*"')
+_GRAMMAR_OPERATOR_RE = re.compile(r'[+*?()|\[\]{}]')
+_RULE_NAME_RE = re.compile(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b')
+_SINGLE_QUOTED_STRING_RE = re.compile(r"'([^']*)'")
+
 
 def grammar_is_likely_lark(grammar_str: str) -> bool:
     """
@@ -26,7 +34,7 @@ def grammar_is_likely_lark(grammar_str: str) -> bool:
 
     for line in grammar_str.split('\n'):
         # Remove both comment styles
-        line = re.sub(r'(#|//).*$', '', line).strip()
+        line = _COMMENT_RE.sub('', line).strip()
         if not line:
             continue
 
@@ -68,7 +76,7 @@ def convert_lark_to_ebnf(grammar_str: str) -> str:
 
     def clean_line(line: str) -> str:
         """Remove comments and whitespace from line."""
-        return re.sub(r'(#|//).*$', '', line).strip()
+        return _COMMENT_RE.sub('', line).strip()
 
     def check_quotes(text: str, rule_name: str, line_num: int) -> None:
         """Validate quote matching in text."""
@@ -79,9 +87,9 @@ def convert_lark_to_ebnf(grammar_str: str) -> str:
     def extract_references(text: str) -> set:
         """Extract rule references from text."""
         # Remove quoted strings and special characters
-        text = re.sub(r'"[^"]*"', '', text)
-        text = re.sub(r'[+*?()|\[\]{}]', ' ', text)
-        return set(re.findall(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b', text))
+        text = _QUOTED_STRING_RE.sub('', text)
+        text = _GRAMMAR_OPERATOR_RE.sub(' ', text)
+        return set(_RULE_NAME_RE.findall(text))
 
     # First pass: Find root rule and validate rule definitions
     lines = [clean_line(line) for line in grammar_str.split('\n')]
@@ -129,7 +137,7 @@ def convert_lark_to_ebnf(grammar_str: str) -> str:
                 current_rule = name.strip().strip('?')
 
                 check_quotes(definition, f"rule '{current_rule}'", line_num)
-                definition = re.sub(r"'([^']*)'", r'"\1"', definition)
+                definition = _SINGLE_QUOTED_STRING_RE.sub(r'"\1"', definition)
                 referenced_rules.update(extract_references(definition))
                 current_definition = [definition.strip()]
 
@@ -141,7 +149,7 @@ def convert_lark_to_ebnf(grammar_str: str) -> str:
                 alt_def = line[1:].strip()
                 check_quotes(alt_def, f"alternative for rule '{current_rule}'",
                              line_num)
-                alt_def = re.sub(r"'([^']*)'", r'"\1"', alt_def)
+                alt_def = _SINGLE_QUOTED_STRING_RE.sub(r'"\1"', alt_def)
                 referenced_rules.update(extract_references(alt_def))
                 current_definition.append(alt_def)
 
@@ -273,6 +273,10 @@ class GPUModelRunner(LoRAModelRunnerMixin):
                                         device="cpu",
                                         pin_memory=self.pin_memory)
         self.seq_lens_np = self.seq_lens_cpu.numpy()
+        # Staging buffer for the structured output bitmask. Its width depends
+        # on the vocabulary of the structured output backend, so it is only
+        # allocated on the first structured output request.
+        self.grammar_bitmask_cpu: Optional[torch.Tensor] = None
 
     def _update_states(self, scheduler_output: "SchedulerOutput") -> None:
         """Update the cached states and the persistent batch with the scheduler
@@ -974,21 +978,42 @@ class GPUModelRunner(LoRAModelRunnerMixin):
                 indices_match = False
             struct_out_req_batch_indices[req_id] = batch_index
 
-        if not indices_match:
-            # Sort the bitmask to match the order of the requests
-            sorted_bitmask = np.zeros_like(grammar_bitmask)
-            for req_id, batch_index in struct_out_req_batch_indices.items():
-                orig_index = scheduler_output.structured_output_request_ids[
-                    req_id]
-                sorted_bitmask[batch_index] = grammar_bitmask[orig_index]
-            grammar_bitmask = sorted_bitmask
+        # Stage the bitmask in a persistent pinned buffer so that the copy to
+        # the device is asynchronous and does not allocate pinned memory
+        # every step.
+        num_rows, num_words = grammar_bitmask.shape
+        if (self.grammar_bitmask_cpu is None
+                or self.grammar_bitmask_cpu.shape[0] < num_rows
+                or self.grammar_bitmask_cpu.shape[1] != num_words):
+            self.grammar_bitmask_cpu = torch.empty(
+                (max(num_rows, self.max_num_reqs), num_words),
+                dtype=torch.int32,
+                device="cpu",
+                pin_memory=self.pin_memory)
+        bitmask_cpu = self.grammar_bitmask_cpu[:num_rows]
+        bitmask_np = bitmask_cpu.numpy()
 
-        grammar_bitmask = torch.from_numpy(grammar_bitmask)
+        if not indices_match:
+            # Sort the bitmask to match the order of the requests with a
+            # single gather/scatter of the packed rows.
+            orig_indices = np.fromiter(
+                (scheduler_output.structured_output_request_ids[req_id]
+                 for req_id in struct_out_req_batch_indices),
+                dtype=np.int64,
+                count=len(struct_out_req_batch_indices))
+            batch_indices = np.fromiter(
+                struct_out_req_batch_indices.values(),
+                dtype=np.int64,
+                count=len(struct_out_req_batch_indices))
+            bitmask_np.fill(0)
+            bitmask_np[batch_indices] = grammar_bitmask[orig_indices]
+        else:
+            bitmask_np[:] = grammar_bitmask
 
         # TODO: compatibility with spec decode
         xgr.apply_token_bitmask_inplace(
             logits,
-            grammar_bitmask.to(self.device, non_blocking=True),
+            bitmask_cpu.to(self.device, non_blocking=True),
             indices=list(struct_out_req_batch_indices.values()),
         )
 